@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import os
+from functools import lru_cache
 from pathlib import Path
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -17,12 +19,48 @@ EXCEL_DB_PATH = DB_DIR / "excel.db"
 ANALYTICS_DB_PATH = DB_DIR / "analytics.db"
 
 
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def _apply_sqlite_pragmas(dbapi_conn, connection_record) -> None:
+    # WAL lets analytics writes from /chat proceed alongside concurrent reads
+    cursor = dbapi_conn.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def _create_sqlite_engine(db_path: Path) -> Engine:
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        future=True,
+        poolclass=QueuePool,
+        pool_size=5,
+        max_overflow=10,
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+
+# Engines are shared process-wide so every request reuses the same pool
+@lru_cache(maxsize=1)
 def get_excel_engine() -> Engine:
-    return create_engine(f"sqlite:///{EXCEL_DB_PATH}", future=True)
+    return _create_sqlite_engine(EXCEL_DB_PATH)
 
 
+@lru_cache(maxsize=1)
 def get_analytics_engine() -> Engine:
-    return create_engine(f"sqlite:///{ANALYTICS_DB_PATH}", future=True)
+    return _create_sqlite_engine(ANALYTICS_DB_PATH)
 
 
 def init_analytics_schema() -> None:
@@ -56,4 +94,11 @@ def init_analytics_schema() -> None:
             pass
 
 
-
+def optimize_analytics_db() -> None:
+    """
+    Refresh SQLite planner statistics for the analytics DB.
+    Cheap to run; SQLite only re-analyzes tables whose stats are stale.
+    """
+    engine = get_analytics_engine()
+    with engine.begin() as conn:
+        conn.execute(text("PRAGMA optimize"))
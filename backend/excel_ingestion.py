@@ -1,26 +1,171 @@
 from __future__ import annotations
 
+import csv
+import re
+import sqlite3
 from pathlib import Path
+from typing import Dict, Optional, Set
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from sqlalchemy import text
 
-from .db import get_excel_engine
+from .db import EXCEL_DB_PATH, get_excel_engine
+
+
+CSV_BLOCK_SIZE = 8 << 20
+# Columns the Excel agent's generated SQL filters on most often
+SOCIAL_LISTENING_INDEXES = {
+    "cat": ("ProductCategory",),
+    "ret": ("RetailerName",),
+    "mfg": ("ManufacturerName",),
+    "sale": ("ProductOnSale",),
+    "cat_ret": ("ProductCategory", "RetailerName"),
+}
+
+# Declared column types; mirrors the schema given to the Excel SQL agent
+SOCIAL_LISTENING_SCHEMA = {
+    "ProductModelName": "TEXT",
+    "ProductCategory": "TEXT",
+    "ProductPrice": "REAL",
+    "RetailerName": "TEXT",
+    "RetailerZip": "REAL",
+    "RetailerCity": "TEXT",
+    "RetailerState": "TEXT",
+    "ProductOnSale": "TEXT",
+    "ManufacturerName": "TEXT",
+    "ManufacturerRebate": "TEXT",
+    "UserID": "TEXT",
+    "UserAge": "REAL",
+    "UserGender": "TEXT",
+    "UserOccupation": "TEXT",
+    "ReviewRating": "REAL",
+    "ReviewDate": "TEXT",
+    "ReviewText": "TEXT",
+    "sentiment": "TEXT",
+    "problem": "TEXT",
+    "about": "TEXT",
+    "keywords": "TEXT",
+}
+
+EXCEL_DB_PAGE_SIZE = 8192
+
+
+def _init_excel_db_file() -> None:
+    # page_size only takes effect on an empty DB and cannot change once the
+    # engine switches it to WAL, so set it before any pooled connection opens.
+    if EXCEL_DB_PATH.exists():
+        return
+    conn = sqlite3.connect(str(EXCEL_DB_PATH))
+    try:
+        conn.execute(f"PRAGMA page_size={EXCEL_DB_PAGE_SIZE}")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+_ARROW_TYPES = {"REAL": pa.float64(), "TEXT": pa.string()}
+_CONVERSION_ERROR_COLUMN = re.compile(r"In CSV column #(\d+)")
+
+
+def _sqlite_type(column: str, arrow_type: pa.DataType, declared: Dict[str, str]) -> str:
+    if column in declared:
+        return declared[column]
+    if pa.types.is_integer(arrow_type):
+        return "INTEGER"
+    if pa.types.is_floating(arrow_type):
+        return "REAL"
+    return "TEXT"
+
+
+def _unconvertible_column(csv_path: Path, err: pa.ArrowInvalid) -> Optional[str]:
+    """Name of the column a CSV conversion error refers to, if any."""
+    match = _CONVERSION_ERROR_COLUMN.search(str(err))
+    if match is None:
+        return None
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f), [])
+    index = int(match.group(1))
+    return header[index] if index < len(header) else None
 
 
 def ingest_social_listening(csv_path: Path, table_name: str = "social_listening") -> int:
     """
-    Load the social listening CSV into SQLite using Pandas.
+    Stream the social listening CSV into SQLite using Arrow's CSV reader.
     Returns number of rows inserted.
     """
-    df = pd.read_csv(csv_path)
+    text_columns: Set[str] = set()
+    while True:
+        try:
+            return _ingest_csv(csv_path, table_name, text_columns)
+        except pa.ArrowInvalid as e:
+            # A stray non-numeric cell in a REAL column: load that column as
+            # TEXT, as pd.read_csv did with an object column, and start over
+            column = _unconvertible_column(csv_path, e)
+            if column is None or column in text_columns:
+                raise
+            print(f"Column {column!r} has non-numeric values; ingesting it as TEXT")
+            text_columns.add(column)
+
+
+def _ingest_csv(csv_path: Path, table_name: str, text_columns: Set[str]) -> int:
+    declared = {
+        col: "TEXT" if col in text_columns else sql_type
+        for col, sql_type in SOCIAL_LISTENING_SCHEMA.items()
+    }
+    # Pin declared columns so every block parses to the same types
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            column_types={
+                col: _ARROW_TYPES[sql_type] for col, sql_type in declared.items()
+            },
+            # Blank cells become NULL, as they did with pd.read_csv
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=True,
+        ),
+    )
+    # Name the CSV's blank index header the way pandas used to ("Unnamed: 0")
+    column_names = [
+        field.name or f"Unnamed: {i}" for i, field in enumerate(reader.schema)
+    ]
+    column_defs = ", ".join(
+        f'"{name}" {_sqlite_type(name, field.type, declared)}'
+        for name, field in zip(column_names, reader.schema)
+    )
+    placeholders = ", ".join("?" for _ in column_names)
+    insert_sql = f'INSERT INTO "{table_name}" VALUES ({placeholders})'
+
+    _init_excel_db_file()
     engine = get_excel_engine()
+    total_rows = 0
 
     with engine.begin() as conn:
-        # Replace table on re-ingest
-        df.to_sql(table_name, conn, if_exists="replace", index=False)
+        # Replace table on re-ingest with an explicitly typed schema;
+        # all batches share one transaction
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+        conn.execute(text(f'CREATE TABLE "{table_name}" ({column_defs})'))
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            rows = list(zip(*(col.to_pylist() for col in batch.columns)))
+            conn.exec_driver_sql(insert_sql, rows)
+            total_rows += batch.num_rows
+        # The table is dropped on re-ingest, so indexes are rebuilt every time
+        for suffix, columns in SOCIAL_LISTENING_INDEXES.items():
+            if not set(columns).issubset(column_names):
+                continue
+            cols_sql = ", ".join(f'"{c}"' for c in columns)
+            conn.execute(
+                text(
+                    f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{suffix}" '
+                    f'ON "{table_name}" ({cols_sql})'
+                )
+            )
+        conn.execute(text(f'ANALYZE "{table_name}"'))
 
-    return len(df)
+    return total_rows
 
 
 def run_structured_query(natural_language_query: str, table_name: str = "social_listening") -> dict:
@@ -1,16 +1,23 @@
 from __future__ import annotations
 
+import hashlib
+import re
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Annotated, Dict, List, Literal, Optional, TypedDict
+from functools import lru_cache
+from typing import Annotated, Dict, Iterator, List, Literal, Optional, Tuple, TypedDict
 
+import pandas as pd
 from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from sqlalchemy import text
 
 from .db import get_excel_engine, get_analytics_engine
-from .llm import chat_completion
+from .llm import chat_completion, chat_completion_stream
 from .pdf_ingestion import pdf_semantic_search
 
 
@@ -23,6 +30,14 @@ class OmniState(TypedDict):
     start_time: float
 
 
+def _last_user(state: OmniState) -> Optional[HumanMessage]:
+    # Scan from the end: the latest user turn is almost always near the tail
+    return next(
+        (m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)),
+        None,
+    )
+
+
 ROUTER_SYSTEM_PROMPT = """
 You are a routing controller for an analytics chatbot.
 Decide the best primary source for answering the user's question:
@@ -34,12 +49,37 @@ Answer with a single word: excel, pdf, or both.
 """
 
 
+# Cheap keyword pre-classifier; Gemini is only consulted when these are
+# inconclusive (no hits, or hits for both sources).
+_EXCEL_KEYWORDS_RE = re.compile(
+    r"\b(smart ?phones?|laptops?|tablets?|tvs?|bestbuy|best buy|walmart|samsung"
+    r"|average|avg|count|how many|price|prices|rating|ratings)\b",
+    re.IGNORECASE,
+)
+_PDF_KEYWORDS_RE = re.compile(
+    r"\b(polic(?:y|ies)|documents?|chapters?|sections?|summari[sz]e|strategy)\b",
+    re.IGNORECASE,
+)
+
+
+def _keyword_route(question: str) -> Optional[str]:
+    is_excel = _EXCEL_KEYWORDS_RE.search(question) is not None
+    is_pdf = _PDF_KEYWORDS_RE.search(question) is not None
+    if is_excel and not is_pdf:
+        return "excel"
+    if is_pdf and not is_excel:
+        return "pdf"
+    return None
+
+
 def _router_node(state: OmniState) -> OmniState:
-    last_user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
-    route = chat_completion(
-        ROUTER_SYSTEM_PROMPT,
-        [{"role": "user", "content": last_user_msg.content}],
-    ).strip().lower()
+    last_user_msg = _last_user(state)
+    route = _keyword_route(last_user_msg.content)
+    if route is None:
+        route = chat_completion(
+            ROUTER_SYSTEM_PROMPT,
+            [{"role": "user", "content": last_user_msg.content}],
+        ).strip().lower()
     if route not in {"excel", "pdf", "both"}:
         route = "pdf"
     state["routing_decision"] = route  # type: ignore[assignment]
@@ -47,9 +87,8 @@ def _router_node(state: OmniState) -> OmniState:
     return state
 
 
-def _pdf_retriever_node(state: OmniState) -> OmniState:
-    last_user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
-    result = pdf_semantic_search(last_user_msg.content, k=5)
+def _retrieve_pdf(question: str) -> Tuple[Optional[str], List[Dict]]:
+    result = pdf_semantic_search(question, k=5)
     docs = result.get("documents", [[]])[0]
     metas = result.get("metadatas", [[]])[0]
 
@@ -67,9 +106,22 @@ def _pdf_retriever_node(state: OmniState) -> OmniState:
             }
         )
 
-    if context_parts:
-        state["retrieval_context"] = "\n\n".join(context_parts)
-        state["citations"].extend(citations)
+    if not context_parts:
+        return None, []
+    return "\n\n".join(context_parts), citations
+
+
+def _merge_retrieval(state: OmniState, context: Optional[str], citations: List[Dict]) -> None:
+    if not context:
+        return
+    prev = state.get("retrieval_context")
+    state["retrieval_context"] = (prev + "\n\n" + context) if prev else context
+    state["citations"].extend(citations)
+
+
+def _pdf_retriever_node(state: OmniState) -> OmniState:
+    last_user_msg = _last_user(state)
+    _merge_retrieval(state, *_retrieve_pdf(last_user_msg.content))
     return state
 
 
@@ -123,9 +175,7 @@ Follow the same style for any other question and only output the final SQL query
 """
 
 
-def _excel_agent_node(state: OmniState) -> OmniState:
-    last_user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
-    nl = last_user_msg.content
+def _retrieve_excel(nl: str) -> Tuple[str, List[Dict]]:
     sql = chat_completion(
         EXCEL_SQL_SYSTEM_PROMPT,
         [{"role": "user", "content": nl}],
@@ -141,29 +191,47 @@ def _excel_agent_node(state: OmniState) -> OmniState:
     with engine.begin() as conn:
         result = conn.execute(text(sql))
         columns = list(result.keys())
-        rows = [dict(zip(columns, r)) for r in result.fetchall()]
+        # Row objects are already positional sequences; no per-row dicts needed
+        rows = result.fetchall()
 
-    if len(rows) == 1 and rows[0].get("note") == "NO_ANSWER":
+    if len(rows) == 1 and columns == ["note"] and rows[0][0] == "NO_ANSWER":
         table_text = "No structured answer available from Excel for this question."
     else:
-        # Simple text table representation for the LLM
-        header = " | ".join(columns)
-        sep = " | ".join(["---"] * len(columns))
-        body_lines = []
-        for r in rows[:50]:
-            body_lines.append(" | ".join(str(r.get(c, "")) for c in columns))
-        table_text = header + "\n" + sep + "\n" + "\n".join(body_lines)
+        # Markdown table representation for the LLM
+        df = pd.DataFrame(rows[:50], columns=columns)
+        table_text = df.to_markdown(index=False)
 
     context = f"Structured result from Excel (table social_listening):\n{table_text}"
-    prev = state.get("retrieval_context")
-    state["retrieval_context"] = (prev + "\n\n" + context) if prev else context
-    state["citations"].append(
+    citations = [
         {
             "source_type": "excel",
             "table": "social_listening",
             "note": "SQLite query result",
         }
-    )
+    ]
+    return context, citations
+
+
+def _excel_agent_node(state: OmniState) -> OmniState:
+    last_user_msg = _last_user(state)
+    _merge_retrieval(state, *_retrieve_excel(last_user_msg.content))
+    return state
+
+
+def _both_retriever_node(state: OmniState) -> OmniState:
+    # PDF search and the Excel SQL generation are independent and both block on
+    # I/O (Chroma, Gemini), so run them side by side instead of back to back.
+    last_user_msg = _last_user(state)
+    question = last_user_msg.content
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        pdf_future = pool.submit(_retrieve_pdf, question)
+        excel_future = pool.submit(_retrieve_excel, question)
+        pdf_result = pdf_future.result()
+        excel_result = excel_future.result()
+
+    # Keep PDF-then-Excel ordering of the sequential pipeline
+    _merge_retrieval(state, *pdf_result)
+    _merge_retrieval(state, *excel_result)
     return state
 
 
@@ -182,11 +250,54 @@ Guidelines:
 """
 
 
-def _answer_node(state: OmniState) -> OmniState:
-    last_user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
+ANSWER_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_TTL_S = 600.0
+
+# key -> (timestamp, answer); OrderedDict gives LRU eviction order
+_answer_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+
+def _answer_cache_key(route: Optional[str], question: str, retrieval_context: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (route or "", question, retrieval_context):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _answer_cache_get(key: str) -> Optional[str]:
+    with _answer_cache_lock:
+        entry = _answer_cache.get(key)
+        if entry is None:
+            return None
+        ts, answer = entry
+        if time.time() - ts > ANSWER_CACHE_TTL_S:
+            del _answer_cache[key]
+            return None
+        _answer_cache.move_to_end(key)
+        return answer
+
+
+def _answer_cache_put(key: str, answer: str) -> None:
+    with _answer_cache_lock:
+        _answer_cache[key] = (time.time(), answer)
+        _answer_cache.move_to_end(key)
+        while len(_answer_cache) > ANSWER_CACHE_MAX_ENTRIES:
+            _answer_cache.popitem(last=False)
+
+
+def _prepare_answer(state: OmniState) -> Tuple[str, str]:
+    """Returns (answer cache key, answer prompt) for the current state."""
+    last_user_msg = _last_user(state)
     retrieval_context = state.get("retrieval_context") or "No external context."
     citations = state.get("citations", [])
 
+    # Same route + question + retrieved context yields the same prompt, so the
+    # Gemini round-trip can be skipped for repeats.
+    cache_key = _answer_cache_key(
+        state.get("routing_decision"), last_user_msg.content, retrieval_context
+    )
     prompt = (
         f"User question:\n{last_user_msg.content}\n\n"
         f"Retrieved context:\n{retrieval_context}\n\n"
@@ -194,15 +305,35 @@ def _answer_node(state: OmniState) -> OmniState:
         "Now answer the question. At the end, add a 'Sources:' section listing each source "
         "in the form 'PDF: <file>, page <n>' or 'Excel: social_listening table'."
     )
+    return cache_key, prompt
+
+
+def _answer_node(state: OmniState) -> OmniState:
+    cache_key, prompt = _prepare_answer(state)
+    cached = _answer_cache_get(cache_key)
+    if cached is not None:
+        state["messages"].append(AIMessage(content=cached))
+        return state
 
     answer_text = chat_completion(
         ANSWER_SYSTEM_PROMPT,
         [{"role": "user", "content": prompt}],
     )
+    _answer_cache_put(cache_key, answer_text)
     state["messages"].append(AIMessage(content=answer_text))
     return state
 
 
+# Built once so SQLAlchemy's compiled-statement cache is hit on every insert
+_INSERT_QUERY_STMT = text(
+    """
+    INSERT INTO queries (timestamp, conversation_id, user_query, routed_source,
+                         success, feedback, response_time_ms)
+    VALUES (:ts, :cid, :q, :src, :success, :feedback, :rt)
+    """
+)
+
+
 def _log_analytics(state: OmniState, conversation_id: str) -> int:
     engine = get_analytics_engine()
     now = datetime.utcnow().isoformat()
@@ -211,13 +342,7 @@ def _log_analytics(state: OmniState, conversation_id: str) -> int:
 
     with engine.begin() as conn:
         result = conn.execute(
-            text(
-                """
-                INSERT INTO queries (timestamp, conversation_id, user_query, routed_source,
-                                     success, feedback, response_time_ms)
-                VALUES (:ts, :cid, :q, :src, :success, :feedback, :rt)
-                """
-            ),
+            _INSERT_QUERY_STMT,
             dict(
                 ts=now,
                 cid=conversation_id,
@@ -228,37 +353,41 @@ def _log_analytics(state: OmniState, conversation_id: str) -> int:
                 rt=duration_ms,
             ),
         )
-        query_id = getattr(result, "lastrowid", None)
-        if not query_id:
+        # pysqlite populates lastrowid for single-row INSERTs
+        query_id = result.lastrowid
+        if query_id is None:
             query_id = conn.execute(text("SELECT last_insert_rowid()")).scalar_one()
 
     return int(query_id or 0)
 
 
 def _get_last_user_text(state: OmniState) -> str:
-    users = [m for m in state["messages"] if isinstance(m, HumanMessage)]
-    return users[-1].content if users else ""
+    last = _last_user(state)
+    return last.content if last is not None else ""
 
 
-def build_graph():
+def build_graph(include_answer: bool = True):
+    """
+    include_answer=False stops after retrieval, for callers that generate
+    (e.g. stream) the final answer themselves.
+    """
     graph = StateGraph(OmniState)
 
     graph.add_node("router", _router_node)
     graph.add_node("pdf_retriever", _pdf_retriever_node)
     graph.add_node("excel_agent", _excel_agent_node)
-    graph.add_node("answer", _answer_node)
+    graph.add_node("both_retriever", _both_retriever_node)
+    if include_answer:
+        graph.add_node("answer", _answer_node)
 
     graph.set_entry_point("router")
 
     def route_decision(state: OmniState):
         decision = state.get("routing_decision") or "pdf"
-        if decision == "pdf":
-            return "pdf_retriever"
         if decision == "excel":
             return "excel_agent"
         if decision == "both":
-            # For "both", start with PDF retriever, then excel will be called after
-            return "pdf_retriever"
+            return "both_retriever"
         return "pdf_retriever"
 
     graph.add_conditional_edges(
@@ -267,37 +396,34 @@ def build_graph():
         {
             "pdf_retriever": "pdf_retriever",
             "excel_agent": "excel_agent",
-        },
-    )
-
-    # After PDF retriever, check if we need Excel too
-    def after_pdf(state: OmniState):
-        decision = state.get("routing_decision") or "pdf"
-        if decision == "both":
-            return "excel_agent"
-        return "answer"
-
-    graph.add_conditional_edges(
-        "pdf_retriever",
-        after_pdf,
-        {
-            "excel_agent": "excel_agent",
-            "answer": "answer",
+            "both_retriever": "both_retriever",
         },
     )
 
     # After retrievers, always go to answer
-    graph.add_edge("excel_agent", "answer")
-    graph.add_edge("answer", END)
+    after_retrieval = "answer" if include_answer else END
+    graph.add_edge("pdf_retriever", after_retrieval)
+    graph.add_edge("excel_agent", after_retrieval)
+    graph.add_edge("both_retriever", after_retrieval)
+    if include_answer:
+        graph.add_edge("answer", END)
 
     return graph.compile()
 
 
-def run_omni_graph(conversation_id: str, history: List[Dict]) -> Dict:
-    """
-    history: list of {"role": "user"|"assistant", "content": str}
-    Returns: {"answer": str, "routed_source": str, "citations": list, "query_id": int}
-    """
+@lru_cache(maxsize=1)
+def get_workflow():
+    """Compiled graph shared by all requests; built on first use."""
+    return build_graph()
+
+
+@lru_cache(maxsize=1)
+def get_retrieval_workflow():
+    """Compiled router + retrievers graph used by the streaming endpoint."""
+    return build_graph(include_answer=False)
+
+
+def _initial_state(history: List[Dict]) -> OmniState:
     messages: List[BaseMessage] = []
     for m in history:
         if m["role"] == "user":
@@ -305,8 +431,7 @@ def run_omni_graph(conversation_id: str, history: List[Dict]) -> Dict:
         else:
             messages.append(AIMessage(content=m["content"]))
 
-    workflow = build_graph()
-    initial_state: OmniState = {
+    return {
         "messages": messages,
         "routing_decision": None,
         "retrieval_context": None,
@@ -315,6 +440,15 @@ def run_omni_graph(conversation_id: str, history: List[Dict]) -> Dict:
         "start_time": time.time(),
     }
 
+
+def run_omni_graph(conversation_id: str, history: List[Dict]) -> Dict:
+    """
+    history: list of {"role": "user"|"assistant", "content": str}
+    Returns: {"answer": str, "routed_source": str, "citations": list, "query_id": int}
+    """
+    workflow = get_workflow()
+    initial_state = _initial_state(history)
+
     final_state = workflow.invoke(initial_state)
     query_id = _log_analytics(final_state, conversation_id)
 
@@ -327,4 +461,37 @@ def run_omni_graph(conversation_id: str, history: List[Dict]) -> Dict:
     }
 
 
+def stream_omni_graph(conversation_id: str, history: List[Dict]) -> Iterator[Dict]:
+    """
+    Streaming variant of run_omni_graph.
+    Yields {"type": "token", "delta": str} while the answer is generated, then
+    one {"type": "done", "routed_source", "citations", "query_id"} event.
+    """
+    state = get_retrieval_workflow().invoke(_initial_state(history))
+
+    cache_key, prompt = _prepare_answer(state)
+    answer_text = _answer_cache_get(cache_key)
+    if answer_text is not None:
+        yield {"type": "token", "delta": answer_text}
+    else:
+        parts: List[str] = []
+        for delta in chat_completion_stream(
+            ANSWER_SYSTEM_PROMPT,
+            [{"role": "user", "content": prompt}],
+        ):
+            parts.append(delta)
+            yield {"type": "token", "delta": delta}
+        answer_text = "".join(parts)
+        _answer_cache_put(cache_key, answer_text)
+
+    state["messages"].append(AIMessage(content=answer_text))
+    query_id = _log_analytics(state, conversation_id)
+    yield {
+        "type": "done",
+        "routed_source": state.get("routed_source"),
+        "citations": state.get("citations", []),
+        "query_id": query_id,
+    }
+
+
 
@@ -1,5 +1,6 @@
 import os
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Optional
 from dotenv import load_dotenv
 import google.generativeai as genai
 load_dotenv()
@@ -8,29 +9,45 @@ load_dotenv()
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash")
 
 
-def _get_client(system_instruction: str = None):
+_configured = False
+
+
+def _ensure_configured():
+    global _configured
+    if _configured:
+        return
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError("GEMINI_API_KEY environment variable is not set")
     genai.configure(api_key=api_key)
+    _configured = True
+
+
+# One model per system prompt; the graph only uses a handful of prompts.
+@lru_cache(maxsize=8)
+def _get_client(system_instruction: Optional[str] = None):
+    _ensure_configured()
     if system_instruction:
         return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
     return genai.GenerativeModel(GEMINI_MODEL_NAME)
 
 
-def chat_completion(system_prompt: str, messages: List[dict]) -> str:
-    """
-    messages: list of {"role": "user"|"assistant", "content": str}
-    """
-    client = _get_client(system_instruction=system_prompt)
-    
-    # Convert messages to Gemini format
+def _to_gemini_history(messages: List[dict]) -> List[dict]:
     # Gemini uses "user" and "model" roles, not "assistant"
     history = []
     for m in messages:
         role = "model" if m["role"] == "assistant" else "user"
         history.append({"role": role, "parts": [m["content"]]})
-    
+    return history
+
+
+def chat_completion(system_prompt: str, messages: List[dict]) -> str:
+    """
+    messages: list of {"role": "user"|"assistant", "content": str}
+    """
+    client = _get_client(system_instruction=system_prompt)
+    history = _to_gemini_history(messages)
+
     try:
         response = client.generate_content(history)
         if not response.text:
@@ -40,4 +57,16 @@ def chat_completion(system_prompt: str, messages: List[dict]) -> str:
         raise RuntimeError(f"Gemini API error: {str(e)}") from e
 
 
+def chat_completion_stream(system_prompt: str, messages: List[dict]) -> Iterator[str]:
+    """
+    Same as chat_completion, but yields text deltas as Gemini produces them.
+    """
+    client = _get_client(system_instruction=system_prompt)
+    history = _to_gemini_history(messages)
 
+    try:
+        for chunk in client.generate_content(history, stream=True):
+            if chunk.text:
+                yield chunk.text
+    except Exception as e:
+        raise RuntimeError(f"Gemini API error: {str(e)}") from e
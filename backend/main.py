@@ -1,15 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import os
+import threading
 import traceback
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict
+from typing import AsyncIterator, Dict, Iterator, List, Set
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from .db import DATA_DIR, init_analytics_schema, get_analytics_engine
+from .db import (
+    DATA_DIR,
+    init_analytics_schema,
+    get_analytics_engine,
+    optimize_analytics_db,
+)
 from .excel_ingestion import ingest_social_listening
-from .graph import run_omni_graph
+from .graph import get_workflow, run_omni_graph, stream_omni_graph
 from .models import (
     AnalyticsSummary,
     ChatRequest,
@@ -17,10 +28,19 @@ from .models import (
     IngestionResponse,
     FeedbackRequest,
 )
-from .pdf_ingestion import ingest_pdfs
+from .pdf_ingestion import get_pdf_collection, ingest_pdfs
 from sqlalchemy import text
 
 
+ANALYTICS_OPTIMIZE_INTERVAL_S = 900
+MAX_CONVERSATIONS = 1000
+# Only the latest turns are kept; the graph itself reads just the last user turn
+MAX_CONVERSATION_MESSAGES = 20
+ANALYTICS_STREAM_KEEPALIVE_S = 15
+# Streams end after this long (clients reconnect) so shutdown never waits on them
+ANALYTICS_STREAM_MAX_AGE_S = 60
+
+
 app = FastAPI(title="OmniSource Backend", version="0.1.0")
 
 app.add_middleware(
@@ -35,10 +55,17 @@ app.add_middleware(
 @app.on_event("startup")
 def startup_event():
     init_analytics_schema()
-    # Clear analytics data for per-session counting
-    engine = get_analytics_engine()
-    with engine.begin() as conn:
-        conn.execute(text("DELETE FROM queries"))
+    # Clearing analytics for per-session counting is opt-in
+    if os.getenv("OMNI_RESET_ANALYTICS") == "1":
+        engine = get_analytics_engine()
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM queries"))
+        # VACUUM cannot run inside a transaction
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    optimize_analytics_db()
+    get_workflow()
+    get_pdf_collection()
     # Auto-ingest bundled data if present
     pdf_paths = []
     for name in ["omnisource_1.pdf", "omnisource_2.pdf"]:
@@ -53,6 +80,50 @@ def startup_event():
         ingest_social_listening(csv_path)
 
 
+async def _periodic_analytics_optimize():
+    while True:
+        await asyncio.sleep(ANALYTICS_OPTIMIZE_INTERVAL_S)
+        try:
+            await asyncio.to_thread(optimize_analytics_db)
+        except Exception as e:
+            print(f"PRAGMA optimize failed: {e}")
+
+
+@app.on_event("startup")
+async def schedule_analytics_optimize():
+    app.state.optimize_task = asyncio.create_task(_periodic_analytics_optimize())
+
+
+@app.on_event("shutdown")
+async def cancel_analytics_optimize():
+    task = getattr(app.state, "optimize_task", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("startup")
+async def capture_event_loop():
+    # Sync endpoints run in a threadpool and need the loop to notify subscribers
+    app.state.loop = asyncio.get_running_loop()
+
+
+# One queue per /analytics/stream subscriber; maxsize=1 coalesces bursts of changes
+_analytics_subscribers: Set[asyncio.Queue] = set()
+
+
+def _signal_subscriber(queue: asyncio.Queue) -> None:
+    if queue.empty():
+        queue.put_nowait(None)
+
+
+def _notify_analytics_changed() -> None:
+    loop = getattr(app.state, "loop", None)
+    if loop is None:
+        return
+    for queue in list(_analytics_subscribers):
+        loop.call_soon_threadsafe(_signal_subscriber, queue)
+
+
 @app.post("/ingest", response_model=IngestionResponse)
 def ingest_all():
     pdf_paths = []
@@ -68,13 +139,46 @@ def ingest_all():
     return IngestionResponse(pdf_chunks=pdf_chunks, excel_rows=excel_rows)
 
 
+# conversation_id -> last MAX_CONVERSATION_MESSAGES {"role", "content"} entries;
+# least recently used conversation evicted first
+_conversations: "OrderedDict[str, List[Dict]]" = OrderedDict()
+_conversations_lock = threading.Lock()
+
+
+def _conversation_history(req: ChatRequest) -> List[Dict]:
+    """
+    Return the conversation including the request's user turn.
+    Clients may send just the new message, or (legacy) the full transcript.
+    Nothing is stored until the turn has been answered.
+    """
+    if req.message is None:
+        return [m.model_dump() for m in req.messages[-MAX_CONVERSATION_MESSAGES:]]
+    with _conversations_lock:
+        stored = list(_conversations.get(req.conversation_id, []))
+    return stored + [{"role": "user", "content": req.message}]
+
+
+def _remember_answer(conversation_id: str, history: List[Dict], answer: str) -> None:
+    with _conversations_lock:
+        turns = history + [{"role": "assistant", "content": answer}]
+        _conversations[conversation_id] = turns[-MAX_CONVERSATION_MESSAGES:]
+        _conversations.move_to_end(conversation_id)
+        while len(_conversations) > MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+
+
 @app.post("/chat", response_model=ChatResponse)
 def chat(req: ChatRequest):
     try:
+        if req.pending_feedback is not None:
+            _record_feedback(req.pending_feedback)
+        history = _conversation_history(req)
         result = run_omni_graph(
             conversation_id=req.conversation_id,
-            history=[m.dict() for m in req.messages],
+            history=history,
         )
+        _remember_answer(req.conversation_id, history, result["answer"])
+        _notify_analytics_changed()
         return ChatResponse(**result)
     except Exception as e:
         error_msg = f"Chat error: {str(e)}\n{traceback.format_exc()}"
@@ -82,8 +186,37 @@ def chat(req: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/feedback")
-def feedback(req: FeedbackRequest):
+def _sse_events(conversation_id: str, history: List[Dict]) -> Iterator[str]:
+    parts: List[str] = []
+    try:
+        for event in stream_omni_graph(conversation_id, history):
+            if event["type"] == "token":
+                parts.append(event["delta"])
+            elif event["type"] == "done":
+                _remember_answer(conversation_id, history, "".join(parts))
+                _notify_analytics_changed()
+            yield f"event: {event.pop('type')}\ndata: {json.dumps(event)}\n\n"
+    except Exception as e:
+        error_msg = f"Chat error: {str(e)}\n{traceback.format_exc()}"
+        print(error_msg)  # Log to console
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+
+@app.post("/chat/stream")
+def chat_stream(req: ChatRequest):
+    """
+    Server-sent events: 'token' events carry answer deltas, a final 'done'
+    event carries routed_source, citations and query_id.
+    """
+    if req.pending_feedback is not None:
+        _record_feedback(req.pending_feedback)
+    return StreamingResponse(
+        _sse_events(req.conversation_id, _conversation_history(req)),
+        media_type="text/event-stream",
+    )
+
+
+def _record_feedback(fb: FeedbackRequest) -> None:
     engine = get_analytics_engine()
     with engine.begin() as conn:
         conn.execute(
@@ -92,8 +225,14 @@ def feedback(req: FeedbackRequest):
                 "SET feedback = :fb, feedback_text = :fb_text "
                 "WHERE id = :qid"
             ),
-            dict(fb=req.feedback, fb_text=req.feedback_text, qid=req.query_id),
+            dict(fb=fb.feedback, fb_text=fb.feedback_text, qid=fb.query_id),
         )
+    _notify_analytics_changed()
+
+
+@app.post("/feedback")
+def feedback(req: FeedbackRequest):
+    _record_feedback(req)
     return {"status": "ok"}
 
 
@@ -101,7 +240,16 @@ def feedback(req: FeedbackRequest):
 def analytics_summary():
     engine = get_analytics_engine()
     with engine.begin() as conn:
-        total = conn.execute(text("SELECT COUNT(*) FROM queries")).scalar_one()
+        # Totals, latency and feedback counts in one pass over the table
+        totals = conn.execute(
+            text(
+                "SELECT COUNT(*) AS total, "
+                "AVG(response_time_ms) AS avg_rt, "
+                "SUM(CASE WHEN feedback > 0 THEN 1 ELSE 0 END) AS up, "
+                "SUM(CASE WHEN feedback < 0 THEN 1 ELSE 0 END) AS down "
+                "FROM queries"
+            )
+        ).one()
         by_source_rows = conn.execute(
             text(
                 "SELECT routed_source, COUNT(*) AS c FROM queries "
@@ -109,35 +257,54 @@ def analytics_summary():
             )
         ).fetchall()
         by_source: Dict[str, int] = {r[0] or "unknown": r[1] for r in by_source_rows}
-        avg_rt = conn.execute(
-            text("SELECT AVG(response_time_ms) FROM queries")
-        ).scalar()
-        fb_rows = conn.execute(
-            text(
-                "SELECT feedback, COUNT(*) FROM queries "
-                "WHERE feedback IS NOT NULL "
-                "GROUP BY feedback"
-            )
-        ).fetchall()
 
     feedback_summary: Dict[str, int] = {
-        "up": 0,
-        "down": 0,
+        "up": int(totals.up or 0),
+        "down": int(totals.down or 0),
     }
-    for fb, count in fb_rows:
-        if fb is None:
-            continue
-        if fb > 0:
-            feedback_summary["up"] += count
-        elif fb < 0:
-            feedback_summary["down"] += count
 
     return AnalyticsSummary(
-        total_queries=int(total or 0),
+        total_queries=int(totals.total or 0),
         by_source=by_source,
-        avg_response_time_ms=float(avg_rt or 0.0),
+        avg_response_time_ms=float(totals.avg_rt or 0.0),
         feedback_summary=feedback_summary,
     )
 
 
+async def _analytics_events() -> AsyncIterator[str]:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    _analytics_subscribers.add(queue)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ANALYTICS_STREAM_MAX_AGE_S
+    try:
+        while True:
+            summary = await asyncio.to_thread(analytics_summary)
+            yield f"event: summary\ndata: {json.dumps(summary.model_dump())}\n\n"
+            # Block until something changes; comment pings keep proxies from
+            # closing an idle stream.
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(
+                        queue.get(), min(ANALYTICS_STREAM_KEEPALIVE_S, remaining)
+                    )
+                    break
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+    finally:
+        _analytics_subscribers.discard(queue)
+
+
+@app.get("/analytics/stream")
+def analytics_stream():
+    """
+    Server-sent events: pushes the current summary on connect and again
+    whenever a query is logged or feedback is recorded. The stream ends
+    after ANALYTICS_STREAM_MAX_AGE_S; clients are expected to reconnect.
+    """
+    return StreamingResponse(_analytics_events(), media_type="text/event-stream")
+
+
 
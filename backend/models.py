@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 
 class IngestionResponse(BaseModel):
@@ -10,6 +10,12 @@ class IngestionResponse(BaseModel):
     excel_rows: int
 
 
+class FeedbackRequest(BaseModel):
+    query_id: int
+    feedback: int  # +1 for up, -1 for down
+    feedback_text: Optional[str] = None
+
+
 class ChatMessage(BaseModel):
     role: str  # "user" or "assistant"
     content: str
@@ -17,7 +23,17 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     conversation_id: str
-    messages: List[ChatMessage]
+    # Either the new user turn (history is kept server-side) or the full transcript
+    message: Optional[str] = None
+    messages: List[ChatMessage] = []
+    # Feedback on an earlier answer, piggybacked to save a /feedback round-trip
+    pending_feedback: Optional[FeedbackRequest] = None
+
+    @model_validator(mode="after")
+    def _message_or_messages(self) -> "ChatRequest":
+        if (self.message is None) == (not self.messages):
+            raise ValueError("Provide exactly one of 'message' or 'messages'")
+        return self
 
 
 class ChatResponse(BaseModel):
@@ -27,12 +43,6 @@ class ChatResponse(BaseModel):
     query_id: Optional[int] = None
 
 
-class FeedbackRequest(BaseModel):
-    query_id: int
-    feedback: int  # +1 for up, -1 for down
-    feedback_text: Optional[str] = None
-
-
 class AnalyticsSummary(BaseModel):
     total_queries: int
     by_source: Dict[str, int]
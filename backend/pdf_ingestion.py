@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 import uuid
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Iterator, List
 
 import chromadb
+import pymupdf
 from chromadb.config import Settings
 
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 
@@ -16,6 +18,8 @@ DATA_DIR = BASE_DIR / "Data"
 CHROMA_DIR = BASE_DIR / "chroma_pdfs"
 
 
+# Opening the persistent client loads the HNSW index; do it once per process
+@lru_cache(maxsize=1)
 def get_pdf_client():
     CHROMA_DIR.mkdir(exist_ok=True)
     client = chromadb.PersistentClient(
@@ -27,46 +31,74 @@ def get_pdf_client():
 
 PDF_COLLECTION_NAME = "pdf_docs"
 
+# Stateless, so one instance serves every ingest call
+_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1200,
+    chunk_overlap=200,
+)
 
+
+@lru_cache(maxsize=1)
 def get_pdf_collection():
     client = get_pdf_client()
     return client.get_or_create_collection(PDF_COLLECTION_NAME)
 
 
+PDF_INGEST_BATCH_SIZE = 256
+
+
+def iter_pdf_pages(pdf_path: Path) -> Iterator[Document]:
+    """
+    Yield one Document per page, extracted with PyMuPDF (native MuPDF parser).
+    Page numbers are 0-based, matching what PyPDFLoader produced.
+    """
+    with pymupdf.open(str(pdf_path)) as pdf:
+        for i, page in enumerate(pdf):
+            yield Document(
+                page_content=page.get_text("text"),
+                metadata={"page": i, "file_name": pdf_path.name},
+            )
+
+
 def ingest_pdfs(pdf_paths: List[Path]) -> int:
     """
     Ingest PDFs into dedicated Chroma collection.
     Returns number of chunks added.
     """
     collection = get_pdf_collection()
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1200,
-        chunk_overlap=200,
-    )
     total_chunks = 0
 
-    for pdf_path in pdf_paths:
-        loader = PyPDFLoader(str(pdf_path))
-        pages = loader.load()
-        docs = text_splitter.split_documents(pages)
-
-        documents = [d.page_content for d in docs]
-        metadatas = []
-        ids = []
-        for d in docs:
-            meta = d.metadata or {}
-            metadatas.append(
-                {
-                    "source": "pdf",
-                    "file_name": pdf_path.name,
-                    "page": meta.get("page", meta.get("page_number")),
-                }
-            )
-            ids.append(str(uuid.uuid4()))
+    # Pages are split as they are read and flushed to Chroma in fixed-size
+    # batches, so peak memory is bounded by the batch rather than the corpus.
+    documents: List[str] = []
+    metadatas = []
+    ids = []
+
+    def flush():
+        nonlocal total_chunks
+        if not documents:
+            return
+        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+        total_chunks += len(documents)
+        documents.clear()
+        metadatas.clear()
+        ids.clear()
 
-        if documents:
-            collection.add(documents=documents, metadatas=metadatas, ids=ids)
-            total_chunks += len(documents)
+    for pdf_path in pdf_paths:
+        for page in iter_pdf_pages(pdf_path):
+            for chunk in _SPLITTER.split_text(page.page_content):
+                documents.append(chunk)
+                metadatas.append(
+                    {
+                        "source": "pdf",
+                        "file_name": pdf_path.name,
+                        "page": page.metadata["page"],
+                    }
+                )
+                ids.append(uuid.uuid4().hex)
+                if len(documents) >= PDF_INGEST_BATCH_SIZE:
+                    flush()
+    flush()
 
     return total_chunks
 
@@ -1,127 +1,338 @@
+from __future__ import annotations
+
+import itertools
 import os
+import threading
+import time
 import uuid
+from typing import Any, Callable, Dict, Final, Iterator, Optional, Tuple
 
-import requests
+import httpx
+import orjson
 import streamlit as st
-import pandas as pd
-import altair as alt
 
 
 BACKEND_URL = os.getenv("OMNISOURCE_BACKEND_URL", "http://localhost:8000")
 
+_EXAMPLES_MD: Final[str] = (
+    "- **Excel / CSV examples**:\n"
+    "  - What is the average price of all Smart Phone models sold by Bestbuy?\n"
+    "  - How many Laptop products are sold by Walmart?\n"
+    "  - What is the average review rating for Samsung TVs?\n\n"
+    "- **PDF examples**:\n"
+    "  - Summarize the key recommendations from the omnichannel strategy document.\n"
+    "  - What are the main challenges mentioned for social listening in large enterprises?"
+)
+_RATE_ANSWER_MD: Final[str] = "**Rate this answer**"
+
+
+# Connection problems fail fast; only reading the (LLM-bound) response may take long
+HTTP_TIMEOUT = httpx.Timeout(connect=3.0, read=120.0, write=10.0, pool=5.0)
+
+
+@st.cache_resource
+def _http() -> httpx.Client:
+    # Shared across reruns and sessions so keep-alive connections are reused
+    return httpx.Client(base_url=BACKEND_URL, timeout=HTTP_TIMEOUT)
+
+
+class ChatStreamError(Exception):
+    """The backend reported an error event on the /chat/stream channel."""
+
+
+def _iter_sse(resp: httpx.Response, meta: dict) -> Iterator[str]:
+    """
+    Yield answer deltas from the /chat/stream SSE response.
+    The final 'done' event payload is stored into meta; a stream that ends
+    without one was cut off and raises ChatStreamError.
+    """
+    event = "message"
+    done = False
+    for line in resp.iter_lines():
+        if not line:
+            event = "message"
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            payload = orjson.loads(line[len("data:"):].strip())
+            if event == "token":
+                yield payload["delta"]
+            elif event == "done":
+                meta.update(payload)
+                done = True
+            elif event == "error":
+                raise ChatStreamError(payload.get("detail", "Chat request failed"))
+    if not done:
+        raise ChatStreamError("the answer stream ended before it was complete")
+
+
+# Per-session defaults, built by factories so each session gets fresh values.
+# (st.cache_resource would share one conversation_id across every user.)
+_SESSION_DEFAULTS: Final[Dict[str, Callable[[], Any]]] = {
+    "conversation_id": lambda: str(uuid.uuid4()),
+    "messages": list,
+}
+
 
 def ensure_conversation_id():
-    if "conversation_id" not in st.session_state:
-        st.session_state["conversation_id"] = str(uuid.uuid4())
-    if "messages" not in st.session_state:
-        st.session_state["messages"] = []
+    # All defaults are created together, so one membership check covers them
+    if "conversation_id" in st.session_state:
+        return
+    for key, factory in _SESSION_DEFAULTS.items():
+        st.session_state[key] = factory()
 
 
+# Fragments: widget interactions re-run only the tab they belong to
+@st.fragment
 def render_chat():
     st.subheader("OmniSource Chatbot")
-    ensure_conversation_id()
 
     # Example questions to guide the user
     with st.expander("See example questions"):
-        st.markdown(
-            "- **Excel / CSV examples**:\n"
-            "  - What is the average price of all Smart Phone models sold by Bestbuy?\n"
-            "  - How many Laptop products are sold by Walmart?\n"
-            "  - What is the average review rating for Samsung TVs?\n\n"
-            "- **PDF examples**:\n"
-            "  - Summarize the key recommendations from the omnichannel strategy document.\n"
-            "  - What are the main challenges mentioned for social listening in large enterprises?"
-        )
+        st.markdown(_EXAMPLES_MD)
 
-    # Render chat history
-    for m in st.session_state["messages"]:
-        role = "user" if m["role"] == "user" else "assistant"
-        with st.chat_message(role):
-            st.markdown(m["content"])
+    # Render chat history; the new turn below is added to the same container
+    history_container = st.container()
+    with history_container:
+        for m in st.session_state["messages"]:
+            role = "user" if m["role"] == "user" else "assistant"
+            with st.chat_message(role):
+                st.markdown(m["content"])
 
     # Chat input at the very bottom so it stays anchored after responses
     user_input = st.chat_input("Ask about your data...")
     if user_input:
         st.session_state["messages"].append({"role": "user", "content": user_input})
-        with st.chat_message("user"):
+        with history_container.chat_message("user"):
             st.markdown(user_input)
 
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                resp = requests.post(
-                    f"{BACKEND_URL}/chat",
-                    json={
-                        "conversation_id": st.session_state["conversation_id"],
-                        "messages": st.session_state["messages"],
-                    },
-                    timeout=120,
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                answer = data["answer"]
-                # Store query_id for latest answer for feedback linkage
-                st.session_state["last_query_id"] = data.get("query_id")
-                st.markdown(answer)
-                st.session_state["messages"].append(
-                    {"role": "assistant", "content": answer}
-                )
-                # Force rerun to show feedback controls
-                st.rerun()
-
-    # Feedback controls for most recent assistant message (after input, so it appears below chat)
+        with history_container.chat_message("assistant"):
+            meta: dict = {}
+            # Backend keeps the transcript; only the new turn is sent,
+            # along with any feedback given since the last one
+            body = orjson.dumps(
+                {
+                    "conversation_id": st.session_state["conversation_id"],
+                    "message": user_input,
+                    "pending_feedback": st.session_state.get("pending_feedback"),
+                }
+            )
+            try:
+                with _http().stream(
+                    "POST",
+                    "/chat/stream",
+                    content=body,
+                    headers={"content-type": "application/json"},
+                ) as resp:
+                    # Routing and retrieval happen before the first token, so the
+                    # spinner only covers that wait
+                    with st.spinner("Thinking..."):
+                        resp.raise_for_status()
+                        deltas = _iter_sse(resp, meta)
+                        first = next(deltas, "")
+                    # Render tokens as they arrive instead of waiting for the full answer
+                    answer = st.write_stream(itertools.chain([first], deltas))
+                error = None
+            except (httpx.ConnectTimeout, httpx.ConnectError):
+                error = "Could not reach the backend. Is it running?"
+            except httpx.ReadTimeout:
+                error = "The backend took too long to answer. Please try again."
+            except (httpx.HTTPError, ChatStreamError) as e:
+                error = f"Chat request failed: {e}"
+            if error is not None:
+                # Drop the unanswered turn so it is not shown as part of the conversation
+                st.session_state["messages"].pop()
+                st.error(error)
+                return
+            # The backend has recorded any piggybacked feedback by now
+            st.session_state.pop("pending_feedback", None)
+            # Store query_id for latest answer for feedback linkage
+            st.session_state["last_query_id"] = meta.get("query_id")
+            st.session_state["messages"].append(
+                {"role": "assistant", "content": answer}
+            )
+
+    # Feedback controls for most recent assistant message (after input, so it appears below chat).
+    # Drawn in the same pass as the answer, so no rerun is needed to show them.
+    feedback_placeholder = st.empty()
     if st.session_state["messages"]:
         last_msg = st.session_state["messages"][-1]
         qid = st.session_state.get("last_query_id")
         if last_msg["role"] == "assistant" and qid is not None:
-            st.markdown("---")
-            st.markdown("**Rate this answer**")
-            feedback_text = st.text_input(
-                "Optional feedback", key=f"fb_text_{qid}", placeholder="Tell us what worked well or what was missing..."
-            )
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("Helpful", key=f"up_{qid}"):
-                    try:
-                        resp = requests.post(
-                            f"{BACKEND_URL}/feedback",
-                            json={
-                                "query_id": qid,
-                                "feedback": 1,
-                                "feedback_text": feedback_text or None,
-                            },
-                            timeout=10,
-                        )
-                        resp.raise_for_status()
-                        st.success("Thanks for the feedback.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Failed to submit feedback: {e}")
-            with col2:
-                if st.button("Not helpful", key=f"down_{qid}"):
-                    try:
-                        resp = requests.post(
-                            f"{BACKEND_URL}/feedback",
-                            json={
-                                "query_id": qid,
-                                "feedback": -1,
-                                "feedback_text": feedback_text or None,
-                            },
-                            timeout=10,
-                        )
-                        resp.raise_for_status()
-                        st.info("Feedback recorded.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Failed to submit feedback: {e}")
+            render_feedback(feedback_placeholder, qid)
 
 
+def render_feedback(placeholder, qid: int):
+    with placeholder.container():
+        st.markdown("---")
+        st.markdown(_RATE_ANSWER_MD)
+        feedback_text = st.text_input(
+            "Optional feedback", key=f"fb_text_{qid}", placeholder="Tell us what worked well or what was missing..."
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            helpful = st.button("Helpful", key=f"up_{qid}")
+        with col2:
+            not_helpful = st.button("Not helpful", key=f"down_{qid}")
+
+    # Feedback rides along with the next /chat request instead of its own POST;
+    # render_analytics flushes it if no question follows
+    if helpful:
+        _stash_feedback(placeholder, qid, 1, feedback_text, "Thanks for the feedback. It will be saved shortly.")
+    if not_helpful:
+        _stash_feedback(placeholder, qid, -1, feedback_text, "Thanks. Your rating will be saved shortly.")
+
+
+def _stash_feedback(placeholder, qid: int, score: int, text: Optional[str], success_msg: str):
+    st.session_state["pending_feedback"] = {
+        "query_id": qid,
+        "feedback": score,
+        "feedback_text": text or None,
+    }
+    placeholder.success(success_msg)
+
+
+def _flush_pending_feedback():
+    # Sends a stashed rating on its own when no chat request has carried it
+    pending = st.session_state.get("pending_feedback")
+    if pending is None:
+        return
+    try:
+        resp = _http().post(
+            "/feedback",
+            content=orjson.dumps(pending),
+            headers={"content-type": "application/json"},
+        )
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        # Kept for the next chat request or flush
+        return
+    st.session_state.pop("pending_feedback", None)
+
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _fetch_summary() -> dict:
+    # Raises on failure so errors are never cached
+    resp = _http().get("/analytics/summary", timeout=httpx.Timeout(30.0, connect=3.0))
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
+class _AnalyticsFeed:
+    """
+    Background subscriber to the backend's /analytics/stream SSE channel.
+    Holds the most recently pushed summary so reruns read it without a GET.
+    """
+
+    RECONNECT_DELAY_S = 5
+
+    def __init__(self, base_url: str):
+        self._base_url = base_url
+        self._latest: Optional[dict] = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def latest(self) -> Optional[dict]:
+        with self._lock:
+            return self._latest
+
+    def _run(self):
+        timeout = httpx.Timeout(connect=3.0, read=None, write=10.0, pool=5.0)
+        while True:
+            try:
+                with httpx.stream("GET", f"{self._base_url}/analytics/stream", timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if line.startswith("data:"):
+                            summary = orjson.loads(line[len("data:"):].strip())
+                            with self._lock:
+                                self._latest = summary
+                # The backend ends streams after a while; reconnect right away
+                continue
+            except (httpx.HTTPError, ValueError):
+                pass
+            # Stale once disconnected; readers fall back to polling meanwhile
+            with self._lock:
+                self._latest = None
+            time.sleep(self.RECONNECT_DELAY_S)
+
+
+@st.cache_resource
+def _analytics_feed() -> _AnalyticsFeed:
+    return _AnalyticsFeed(BACKEND_URL)
+
+
+# Chart specs are built (and serialised to Vega-Lite) only when the underlying
+# counts change; cache hits skip pandas and Altair entirely.
+@st.cache_data(show_spinner=False)
+def _source_spec(items: Tuple[Tuple[str, int], ...]) -> dict:
+    # pandas/altair are imported lazily so chat-only sessions never load them
+    import altair as alt
+    import pandas as pd
+
+    # Columnar construction: one list per column, no per-row dicts. Label
+    # normalisation lives here so it only runs on a cache miss; the API keeps
+    # returning raw routed_source values.
+    source_df = pd.DataFrame(
+        {
+            "Source": [src.capitalize() for src, _ in items],
+            "Count": [count for _, count in items],
+        }
+    )
+    return (
+        alt.Chart(source_df)
+        .mark_bar()
+        .encode(
+            x=alt.X("Source", sort="-y", title="Primary routed source"),
+            y=alt.Y("Count", title="Number of queries"),
+            tooltip=["Source", "Count"],
+        )
+        .properties(height=300)
+        .to_dict()
+    )
+
+
+@st.cache_data(show_spinner=False)
+def _feedback_spec(fb_up: int, fb_down: int) -> dict:
+    import altair as alt
+    import pandas as pd
+
+    fb_df = pd.DataFrame(
+        {
+            "Feedback": ["Helpful", "Not helpful"],
+            "Count": [fb_up, fb_down],
+        }
+    )
+    return (
+        alt.Chart(fb_df)
+        .mark_bar()
+        .encode(
+            x=alt.X("Feedback", title="User feedback"),
+            y=alt.Y("Count", title="Number of responses"),
+            color=alt.Color("Feedback", legend=None),
+            tooltip=["Feedback", "Count"],
+        )
+        .properties(height=300)
+        .to_dict()
+    )
+
+
+# Re-runs on its own every 15s to pick up summaries pushed by the backend
+@st.fragment(run_every=15)
 def render_analytics():
     st.subheader("Analytics Dashboard")
-    resp = requests.get(f"{BACKEND_URL}/analytics/summary", timeout=30)
-    if not resp.ok:
-        st.error("Failed to load analytics summary.")
-        return
-    data = resp.json()
+    _flush_pending_feedback()
+    refresh = st.button("Refresh", key="refresh_analytics")
+    if refresh:
+        _fetch_summary.clear()
+    # Prefer the pushed summary; only GET when the push channel is down or on Refresh
+    data = None if refresh else _analytics_feed().latest()
+    if data is None:
+        try:
+            data = _fetch_summary()
+        except httpx.HTTPError:
+            st.error("Failed to load analytics summary.")
+            return
 
     st.metric("Total Queries", data["total_queries"])
     st.metric("Avg Response Time (ms)", round(data["avg_response_time_ms"], 1))
@@ -133,23 +344,8 @@ def render_analytics():
     # Query source usage (routing patterns)
     st.markdown("### Query Source Usage")
     if data["by_source"]:
-        source_df = pd.DataFrame(
-            [
-                {"Source": src.capitalize(), "Count": count}
-                for src, count in data["by_source"].items()
-            ]
-        )
-        source_chart = (
-            alt.Chart(source_df)
-            .mark_bar()
-            .encode(
-                x=alt.X("Source", sort="-y", title="Primary routed source"),
-                y=alt.Y("Count", title="Number of queries"),
-                tooltip=["Source", "Count"],
-            )
-            .properties(height=300)
-        )
-        st.altair_chart(source_chart, use_container_width=True)
+        source_spec = _source_spec(tuple(sorted(data["by_source"].items())))
+        st.vega_lite_chart(source_spec, use_container_width=True)
     else:
         st.write("No source routing data yet.")
 
@@ -160,29 +356,14 @@ def render_analytics():
     if fb_up == 0 and fb_down == 0:
         st.write("No feedback provided yet.")
     else:
-        fb_df = pd.DataFrame(
-            [
-                {"Feedback": "Helpful", "Count": fb_up},
-                {"Feedback": "Not helpful", "Count": fb_down},
-            ]
-        )
-        fb_chart = (
-            alt.Chart(fb_df)
-            .mark_bar()
-            .encode(
-                x=alt.X("Feedback", title="User feedback"),
-                y=alt.Y("Count", title="Number of responses"),
-                color=alt.Color("Feedback", legend=None),
-                tooltip=["Feedback", "Count"],
-            )
-            .properties(height=300)
-        )
-        st.altair_chart(fb_chart, use_container_width=True)
+        fb_spec = _feedback_spec(fb_up, fb_down)
+        st.vega_lite_chart(fb_spec, use_container_width=True)
 
 
 def main():
     st.set_page_config(page_title="OmniSource Chatbot")
     st.title("Multi-Source Analytics Assistant")
+    ensure_conversation_id()
 
     tab_chat, tab_analytics = st.tabs(["Chat", "Analytics"])
     with tab_chat: